@@ -5,9 +5,18 @@ Actually uses the Claude Swarm framework for agent coordination
 """
 
 import asyncio
-import json
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 from pathlib import Path
+from uuid import uuid4
+
+import numpy as np
+import orjson
 
 # MCP imports
 from mcp.server import Server
@@ -19,34 +28,301 @@ from claude_swarm import ClaudeSwarm, ClaudeAgent, ClaudeResponse
 # Storage setup
 STORAGE_DIR = Path("/Users/mayank/claude_swarm_agents_mcp/data")
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
-AGENTS_FILE = STORAGE_DIR / "agents.json"
+AGENTS_FILE = STORAGE_DIR / "agents.jsonl"  # one agent per line
+LEGACY_AGENTS_FILE = STORAGE_DIR / "agents.json"
+EMBEDDINGS_FILE = STORAGE_DIR / "embeddings.f16"  # float16 rows, one per live history message
+SAVE_DELAY = 0.25  # seconds to wait for further changes before writing
 
 # Global state
 swarm_client = ClaudeSwarm()
+_swarm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="swarm")  # one blocking run at a time
 agents = {}  # name -> ClaudeAgent
-conversation_history = []
+agent_previews = {}  # name -> truncated instructions shown by list_agents
+transfer_functions = {}  # name -> function returning that agent
+conversation_history = deque()  # _compress_history keeps this near MAX_HISTORY messages
+_history_summary = ""  # rolling summary of turns dropped from the history
+_search_snapshot = []  # earlier messages visible to search_history during a turn
 current_agent = None
 context_variables = {}
+_turn_lock = asyncio.Lock()  # held for a whole chat turn
+_agents_dirty = asyncio.Event()
+_pending_agents = []  # agents created since the last save, appended on flush
+_rewrite_pending = False  # set when the whole agents file must be rewritten
+_saves_stopping = False  # tells _save_worker to flush once more and exit
+
+# Beyond this many messages older turns are folded into a summary, and the
+# semantic cache is bypassed since the prompt alone no longer captures context
+MAX_HISTORY = 20
+HISTORY_KEEP = MAX_HISTORY // 2  # recent messages kept verbatim on compression
+HISTORY_SEARCH_K = 5  # messages returned by the search_history tool
+
+summarizer_agent = ClaudeAgent(
+    name="Summarizer",
+    model="claude-3-5-haiku-20241022",
+    instructions="Summarize the conversation transcript you are given in a few sentences. Keep names, figures and decisions; drop pleasantries.",
+    functions=[]
+)
+
+class EmbeddingStore:
+    """Float16 memmap of live history message embeddings, keyed by message id; blocking"""
+
+    def __init__(self, vectors_path, dim=384, min_compact_rows=256):
+        self.vectors_path = vectors_path
+        self.dim = dim  # all-MiniLM-L6-v2 output size
+        self.min_compact_rows = min_compact_rows
+        self._rows = {}  # message id -> row in the vectors file
+        self._row_count = 0  # rows in the file, live or dropped
+        self._vectors = None
+        self._lock = threading.Lock()  # search_history runs on the Swarm thread
+        
+        # Message ids are fresh uuid4s each run, so rows from an earlier run are unreachable
+        vectors_path.write_bytes(b"")
+
+    def get(self, msg_id):
+        with self._lock:
+            row = self._rows.get(msg_id)
+            if row is None:
+                return None
+            if self._vectors is None or row >= len(self._vectors):
+                # The file has grown since it was last mapped
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode="r").reshape(-1, self.dim)
+            return self._vectors[row].astype(np.float32)
+
+    def put(self, msg_id, vec):
+        with self._lock:
+            if msg_id in self._rows:
+                return
+            with open(self.vectors_path, "ab") as f:
+                f.write(vec.astype(np.float16).tobytes())
+            self._rows[msg_id] = self._row_count
+            self._row_count += 1
+
+    def drop(self, msg_ids):
+        """Forget messages that left the history, compacting the file once most rows are dead"""
+        with self._lock:
+            for msg_id in msg_ids:
+                self._rows.pop(msg_id, None)
+            if self._row_count - len(self._rows) <= max(len(self._rows), self.min_compact_rows):
+                return
+            
+            live = sorted(self._rows.items(), key=lambda item: item[1])
+            vectors = np.fromfile(self.vectors_path, dtype=np.float16).reshape(-1, self.dim)
+            kept = vectors[[row for _, row in live]]
+            # Release the old mapping before the file is rewritten underneath it
+            self._vectors = None
+            self.vectors_path.write_bytes(kept.tobytes())
+            self._rows = {msg_id: row for row, (msg_id, _) in enumerate(live)}
+            self._row_count = len(live)
+
+class SemanticCache:
+    """Cache of Swarm replies keyed by prompt and context embeddings, per starting agent"""
+
+    def __init__(self, store, model_name="all-MiniLM-L6-v2", query_threshold=0.9,
+                 context_threshold=0.85, top_k=10, context_window=4, ttl=3600):
+        self.store = store  # message id -> vector, so history is embedded once
+        self.model_name = model_name
+        self.query_threshold = query_threshold
+        self.context_threshold = context_threshold
+        self.top_k = top_k
+        self.context_window = context_window
+        self.ttl = ttl
+        self._model = None
+        self._model_lock = threading.Lock()  # embed() runs on worker threads
+        # Per agent: row i of the prompt/context matrices belongs to entry i.
+        # The matrices grow by doubling, so only their first len(entries) rows are used.
+        self._queries = {}  # agent name -> (capacity, dim) matrix of prompt vectors
+        self._contexts = {}  # agent name -> (capacity, dim) matrix of context vectors
+        self._entries = {}  # agent name -> [(created, messages, agent_name, context_variables)]
+
+    def embed(self, text):
+        """Embed text; blocking, so call it off the event loop"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    # Loading the model is slow, so only pay for it on first use
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+    def message_embedding(self, msg):
+        """Embed a history message, reusing the stored vector for its id"""
+        vec = self.store.get(msg["_id"])
+        if vec is None:
+            vec = self.embed(msg["content"])
+            self.store.put(msg["_id"], vec)
+        return vec
+
+    def context_messages(self, recent_messages):
+        """Pick the messages that make up the context, given newest first"""
+        messages = (msg for msg in recent_messages if isinstance(msg.get("content"), str) and msg["content"])
+        return list(islice(messages, self.context_window))
+
+    def context_embedding(self, context_messages):
+        """Mean-pool the embeddings of the messages picked by context_messages()"""
+        vectors = [self.message_embedding(msg) for msg in context_messages]
+        
+        if not vectors:
+            return None
+        pooled = np.mean(vectors, axis=0)
+        return pooled / np.linalg.norm(pooled)
+
+    def lookup(self, agent_name, query_vec, context_vec):
+        """Return the cached (messages, agent_name, context_variables) or None"""
+        entries = self._entries.get(agent_name)
+        if not entries:
+            return None
+        count = len(entries)
+
+        # Tier 1: shortlist the nearest prompts among unexpired entries
+        now = time.time()
+        fresh = np.array([now - entry[0] <= self.ttl for entry in entries])
+        query_scores = np.where(fresh, self._queries[agent_name][:count] @ query_vec, -np.inf)
+        candidates = np.argsort(query_scores)[::-1][:self.top_k]
+        candidates = candidates[query_scores[candidates] >= self.query_threshold]
+        if not len(candidates):
+            return None
+
+        # Tier 2: rerank the shortlist by conversation context. An empty
+        # context only matches another empty context.
+        contexts = self._contexts[agent_name][candidates]
+        if context_vec is None:
+            context_scores = np.where(contexts.any(axis=1), 0.0, 1.0)
+        else:
+            context_scores = contexts @ context_vec
+        best = int(np.argmax(context_scores))
+        if context_scores[best] < self.context_threshold:
+            return None
+        _, *payload = entries[candidates[best]]
+        return tuple(payload)
+
+    def add(self, agent_name, query_vec, context_vec, messages, response_agent_name, response_context):
+        self._evict_expired(agent_name)
+        if context_vec is None:
+            context_vec = np.zeros_like(query_vec)
+        
+        entries = self._entries.setdefault(agent_name, [])
+        count = len(entries)
+        queries = self._queries.get(agent_name)
+        if queries is None or count == len(queries):
+            capacity = max(16, 2 * count)
+            for matrices in (self._queries, self._contexts):
+                grown = np.empty((capacity, query_vec.shape[0]), dtype=np.float32)
+                if count:
+                    grown[:count] = matrices[agent_name][:count]
+                matrices[agent_name] = grown
+        
+        self._queries[agent_name][count] = query_vec
+        self._contexts[agent_name][count] = context_vec
+        entries.append((time.time(), messages, response_agent_name, dict(response_context)))
+
+    def _evict_expired(self, agent_name):
+        entries = self._entries.get(agent_name)
+        if not entries:
+            return
+        now = time.time()
+        keep = [i for i, entry in enumerate(entries) if now - entry[0] <= self.ttl]
+        if len(keep) == len(entries):
+            return
+        for matrices in (self._queries, self._contexts):
+            matrices[agent_name][:len(keep)] = matrices[agent_name][keep]
+        self._entries[agent_name] = [entries[i] for i in keep]
+
+semantic_cache = SemanticCache(EmbeddingStore(EMBEDDINGS_FILE))
+
+async def _run_swarm(**kwargs):
+    """Run swarm_client.run off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_swarm_executor, partial(swarm_client.run, **kwargs))
+
+def _annotate_message(msg):
+    """Give a history message its embedding id and the preview shown by get_conversation_history"""
+    msg.setdefault("_id", uuid4().hex)
+    content = msg.get("content")
+    msg["_preview"] = content[:100] if isinstance(content, str) else ""
+    return msg
+
+def _copy_message(msg):
+    """Copy a stored message without its history annotations, so it gets a fresh id"""
+    return {key: value for key, value in msg.items() if key not in ("_id", "_preview")}
+
+def _extend_history(messages):
+    """Append annotated messages to the history"""
+    for msg in messages:
+        _annotate_message(msg)
+    conversation_history.extend(messages)
+
+async def _compress_history():
+    """Fold all but the most recent messages into the rolling summary"""
+    global _history_summary
+    older_count = max(len(conversation_history) - HISTORY_KEEP, 0)
+    older = list(islice(conversation_history, older_count))
+    transcript = "\n".join(
+        f"{msg.get('role', 'unknown')}: {msg.get('content') or ''}" for msg in older
+    )
+    if _history_summary:
+        transcript = f"Summary so far: {_history_summary}\n{transcript}"
+    response = await _run_swarm(
+        agent=summarizer_agent,
+        messages=[{"role": "user", "content": transcript}],
+        context_variables={}
+    )
+    _history_summary = response.messages[-1].get("content", "") if response.messages else ""
+    
+    for _ in range(older_count):
+        conversation_history.popleft()
+    # Summarized messages are no longer searchable, so free their vectors
+    await asyncio.to_thread(semantic_cache.store.drop, [msg["_id"] for msg in older])
+    print(f"✓ Summarized {len(older)} older messages", file=sys.stderr)
+
+def _embed_turn(user_message, context_messages):
+    """Embed the new prompt and its context for a cache lookup (blocking)"""
+    query_vec = semantic_cache.embed(user_message["content"])
+    semantic_cache.store.put(user_message["_id"], query_vec)
+    return query_vec, semantic_cache.context_embedding(context_messages)
+
+def search_history(query: str):
+    """Search earlier turns of this conversation and return the most relevant messages"""
+    # Runs on the Swarm thread, so read the snapshot taken for this turn
+    # rather than the live history
+    past = [
+        msg for msg in _search_snapshot
+        if isinstance(msg.get("content"), str) and msg["content"]
+    ]
+    if not past:
+        return "No earlier messages in this conversation."
+    
+    query_vec = semantic_cache.embed(query)
+    scores = np.array([semantic_cache.message_embedding(msg) @ query_vec for msg in past])
+    top = sorted(np.argsort(scores)[::-1][:HISTORY_SEARCH_K])
+    return "\n\n".join(f"{past[i].get('role', 'unknown')}: {past[i]['content']}" for i in top)
 
 def load_agents():
     global agents, current_agent
     try:
+        agent_data = {}
         if AGENTS_FILE.exists():
-            with open(AGENTS_FILE, 'r') as f:
-                agent_data = json.load(f)
-            
+            for line in AGENTS_FILE.read_bytes().splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    data = orjson.loads(line)
+                    agent_data[data["name"]] = data
+                except (orjson.JSONDecodeError, KeyError, TypeError) as e:
+                    # A crash mid-append leaves a partial line; rewrite the file without it
+                    print(f"✗ Skipping bad line in {AGENTS_FILE.name}: {e}", file=sys.stderr)
+                    schedule_save()
+        elif LEGACY_AGENTS_FILE.exists():
+            agent_data = orjson.loads(LEGACY_AGENTS_FILE.read_bytes())
+            # Migrate to the line-per-agent format on the next save
+            schedule_save()
+        
+        if agent_data:
             # Recreate ClaudeAgent objects with transfer functions
-            for name, data in agent_data.items():
-                agent = ClaudeAgent(
-                    name=data["name"],
-                    model=data["model"],
-                    instructions=data["instructions"],
-                    functions=[]  # Will add transfer functions below
-                )
-                agents[name] = agent
+            agents.update(_batch_create_agents(agent_data))
             
             # Add transfer functions between agents
-            _setup_transfer_functions()
+            _add_transfer_functions(*agents)
+            print(f"✓ Setup transfer functions for {len(agents)} agents", file=sys.stderr)
             
             if agents and not current_agent:
                 current_agent = list(agents.keys())[0]
@@ -55,47 +331,99 @@ def load_agents():
     except Exception as e:
         print(f"✗ Load error: {e}", file=sys.stderr)
 
-def save_agents():
-    """Save agent definitions (functions can't be serialized)"""
+def _create_agent(name, spec):
+    """Build one ClaudeAgent without awaiting, so callers can check and insert atomically"""
+    agent_previews[name] = spec["instructions"][:80]
+    return ClaudeAgent(
+        name=name,
+        model=spec["model"],
+        instructions=spec["instructions"],
+        functions=[]  # Transfer functions are wired up by the caller
+    )
+
+def _batch_create_agents(specs):
+    """Build ClaudeAgents for a {name: {"model", "instructions"}} mapping in one pass"""
+    return {name: _create_agent(name, spec) for name, spec in specs.items()}
+
+def _write_file(path, data, mode):
+    """Open, write and close in one call, so it costs a single executor round-trip"""
+    with open(path, mode) as f:
+        f.write(data)
+
+async def save_agents(names=None):
+    """Append the named agents, or rewrite all of them; returns whether the write succeeded"""
+    # Functions can't be serialized, so only name, model and instructions are kept
     try:
-        agent_data = {}
-        for name, agent in agents.items():
-            agent_data[name] = {
-                "name": agent.name,
-                "model": agent.model,
-                "instructions": agent.instructions
-            }
+        data = b"".join(
+            orjson.dumps(
+                {"name": agent.name, "model": agent.model, "instructions": agent.instructions},
+                option=orjson.OPT_APPEND_NEWLINE
+            )
+            for agent in (agents[name] for name in (agents if names is None else names))
+        )
         
-        with open(AGENTS_FILE, 'w') as f:
-            json.dump(agent_data, f, indent=2)
-        print(f"✓ Saved {len(agents)} Swarm agents", file=sys.stderr)
+        await asyncio.to_thread(_write_file, AGENTS_FILE, data, 'wb' if names is None else 'ab')
+        print(f"✓ Saved {len(agents) if names is None else len(names)} Swarm agents", file=sys.stderr)
+        return True
     except Exception as e:
         print(f"✗ Save error: {e}", file=sys.stderr)
+        return False
 
-def _setup_transfer_functions():
-    """Create transfer functions between agents for true Swarm behavior"""
-    # Create transfer functions for each agent pair
-    transfer_functions = {}
-    
-    for target_name, target_agent in agents.items():
-        def create_transfer(target):
-            def transfer_function():
-                f"""Transfer to {target.name} for specialized analysis"""
-                return target
-            transfer_function.__name__ = f"transfer_to_{target.name.lower().replace(' ', '_')}"
-            transfer_function.__doc__ = f"Transfer to {target.name} for their specialized expertise"
-            return transfer_function
+def schedule_save(*names):
+    """Queue new agents for saving, or a full rewrite when no names are given"""
+    global _rewrite_pending
+    if names:
+        _pending_agents.extend(names)
+    else:
+        _rewrite_pending = True
+    _agents_dirty.set()
+
+async def _flush_saves():
+    """Write out everything queued by schedule_save()"""
+    global _rewrite_pending
+    names, rewrite = list(_pending_agents), _rewrite_pending
+    _pending_agents.clear()
+    _rewrite_pending = False
+    _agents_dirty.clear()
+    if not await save_agents(None if rewrite else names):
+        # A failed append may leave a partial line, so retry with a full rewrite
+        schedule_save()
+
+async def _save_worker():
+    """Coalesce bursts of agent changes into a single background write"""
+    while True:
+        await _agents_dirty.wait()
+        if not _saves_stopping:
+            await asyncio.sleep(SAVE_DELAY)
+        if _pending_agents or _rewrite_pending:
+            await _flush_saves()
+        if _saves_stopping:
+            # Pick up anything queued, or a retry, while that write was running
+            if _pending_agents or _rewrite_pending:
+                await _flush_saves()
+            return
+
+def _create_transfer(target):
+    """Return a real function (Swarm runners inspect __code__) that hands off to target"""
+    def transfer_function():
+        return target
+    transfer_function.__name__ = f"transfer_to_{target.name.lower().replace(' ', '_')}"
+    transfer_function.__doc__ = f"Transfer to {target.name} for their specialized expertise"
+    return transfer_function
+
+def _add_transfer_functions(*new_names):
+    """Wire newly registered agents into the Swarm transfer graph"""
+    # Only the new agents' edges are built, in both directions
+    for new_name in new_names:
+        new_agent = agents[new_name]
+        transfer_functions[new_name] = _create_transfer(new_agent)
         
-        transfer_functions[target_name] = create_transfer(target_agent)
-    
-    # Add transfer functions to each agent (except self-transfers)
-    for source_name, source_agent in agents.items():
-        source_agent.functions = []
-        for target_name, transfer_func in transfer_functions.items():
-            if target_name != source_name:  # Don't transfer to self
-                source_agent.functions.append(transfer_func)
-    
-    print(f"✓ Setup transfer functions for {len(agents)} agents", file=sys.stderr)
+        # Add history search and transfer functions (except self-transfers)
+        new_agent.functions = [search_history]
+        for name, transfer_func in transfer_functions.items():
+            if name != new_name:
+                agents[name].functions.append(transfer_functions[new_name])
+                new_agent.functions.append(transfer_func)
 
 async def create_agent_handler(args):
     """Create agent with Swarm integration"""
@@ -110,33 +438,27 @@ async def create_agent_handler(args):
         return f"❌ Agent '{name}' already exists"
     
     # Create ClaudeAgent object
-    agent = ClaudeAgent(
-        name=name,
-        model=model,
-        instructions=instructions,
-        functions=[]
-    )
+    agent = _create_agent(name, {"model": model, "instructions": instructions})
     
     agents[name] = agent
     
-    # Rebuild transfer functions for all agents
-    _setup_transfer_functions()
+    # Connect the new agent to the existing ones
+    _add_transfer_functions(name)
     
     # Set as current agent if first one
     global current_agent
     if not current_agent:
         current_agent = name
     
-    save_agents()
+    schedule_save(name)
     print(f"✓ Created Swarm agent: {name}", file=sys.stderr)
     return f"✅ Created Swarm agent '{name}' with transfer capabilities!"
 
 async def chat_with_swarm_handler(args):
     """Chat using actual Swarm framework with agent coordination"""
-    global conversation_history, current_agent, context_variables
+    global current_agent, context_variables, _search_snapshot
     
     message = args.get("message", "")
-    starting_agent_name = args.get("agent_name", current_agent)
     
     if not message:
         return "❌ Message is required"
@@ -144,48 +466,106 @@ async def chat_with_swarm_handler(args):
     if not agents:
         return "❌ No agents available. Create agents first."
     
-    # Get starting agent
-    if starting_agent_name and starting_agent_name in agents:
-        starting_agent = agents[starting_agent_name]
-    else:
-        starting_agent_name = list(agents.keys())[0]
-        starting_agent = agents[starting_agent_name]
-    
-    # Add user message to conversation history
-    user_message = {"role": "user", "content": message}
-    conversation_history.append(user_message)
-    
-    try:
-        # Use actual Claude Swarm framework
-        response = swarm_client.run(
-            agent=starting_agent,
-            messages=conversation_history,
-            context_variables=context_variables,
-            debug=True  # Show agent transfers
-        )
-        
-        # Update global state
-        conversation_history = response.messages
-        current_agent = response.agent.name
-        context_variables.update(response.context_variables)
-        
-        # Get the final response
-        last_message = response.messages[-1] if response.messages else {}
-        agent_response = last_message.get("content", "No response")
+    # One turn at a time: the history, current agent and context variables
+    # are shared, and run() yields the event loop while the Swarm works
+    async with _turn_lock:
+        starting_agent_name = args.get("agent_name", current_agent)
         
-        # Check if agent transfer occurred
-        transfer_info = ""
-        if response.agent.name != starting_agent_name:
-            transfer_info = f"\n\n🔄 **Agent Transfer**: {starting_agent_name} → {response.agent.name}"
+        # Get starting agent
+        if starting_agent_name and starting_agent_name in agents:
+            starting_agent = agents[starting_agent_name]
+        else:
+            starting_agent_name = list(agents.keys())[0]
+            starting_agent = agents[starting_agent_name]
         
-        print(f"✓ Swarm conversation completed: {starting_agent_name} → {response.agent.name}", file=sys.stderr)
+        # Add user message to conversation history
+        user_message = {"role": "user", "content": message}
+        _extend_history([user_message])
         
-        return f"🤖 **{response.agent.name}**:\n\n{agent_response}{transfer_info}"
-        
-    except Exception as e:
-        error_msg = f"❌ Swarm error: {str(e)}"
-        print(error_msg, file=sys.stderr)
-        return error_msg
+        try:
+            skip_semantic_cache = len(conversation_history) > MAX_HISTORY
+            if skip_semantic_cache:
+                await _compress_history()
+            
+            # Paraphrases of a recent prompt in the same context reuse the stored reply
+            cached = None
+            if not skip_semantic_cache:
+                context_messages = semantic_cache.context_messages(islice(reversed(conversation_history), 1, None))
+                query_vec, context_vec = await asyncio.to_thread(_embed_turn, user_message, context_messages)
+                cached = semantic_cache.lookup(starting_agent_name, query_vec, context_vec)
+            if cached:
+                cached_messages, agent_name, cached_context = cached
+                cached_messages = [_copy_message(msg) for msg in cached_messages]
+                _extend_history(cached_messages)
+                current_agent = agent_name
+                context_variables.update(cached_context)
+                
+                last_message = cached_messages[-1] if cached_messages else {}
+                agent_response = last_message.get("content", "No response")
+                
+                transfer_info = ""
+                if agent_name != starting_agent_name:
+                    transfer_info = f"\n\n🔄 **Agent Transfer**: {starting_agent_name} → {agent_name}"
+                
+                print(f"✓ Semantic cache hit: {starting_agent_name} → {agent_name}", file=sys.stderr)
+                
+                return f"🤖 **{agent_name}**:\n\n{agent_response}{transfer_info}"
+            
+            # Send only the new turn so the static agent instructions remain the
+            # whole prompt prefix; earlier turns are recalled through search_history
+            turn_messages = [{"role": "user", "content": message}]  # without the _preview field
+            pointer = []
+            if _history_summary:
+                pointer.append(f"Summary of earlier conversation: {_history_summary}")
+            if len(conversation_history) > 1:
+                pointer.append(f"{len(conversation_history) - 1} earlier messages in this conversation can be recalled with search_history.")
+            if pointer:
+                turn_messages.insert(0, {"role": "system", "content": "\n\n".join(pointer)})
+            
+            # Everything before the new user message
+            _search_snapshot = list(islice(conversation_history, len(conversation_history) - 1))
+            
+            # Use actual Claude Swarm framework
+            response = await _run_swarm(
+                agent=starting_agent,
+                messages=turn_messages,
+                context_variables=context_variables,
+                debug=True  # Show agent transfers
+            )
+            new_messages = response.messages[len(turn_messages):]
+            
+            # Update global state
+            _extend_history(new_messages)
+            current_agent = response.agent.name
+            context_variables.update(response.context_variables)
+            
+            if not skip_semantic_cache:
+                semantic_cache.add(
+                    starting_agent_name,
+                    query_vec,
+                    context_vec,
+                    new_messages,
+                    response.agent.name,
+                    response.context_variables
+                )
+            
+            # Get the final response
+            last_message = response.messages[-1] if response.messages else {}
+            agent_response = last_message.get("content", "No response")
+            
+            # Check if agent transfer occurred
+            transfer_info = ""
+            if response.agent.name != starting_agent_name:
+                transfer_info = f"\n\n🔄 **Agent Transfer**: {starting_agent_name} → {response.agent.name}"
+            
+            print(f"✓ Swarm conversation completed: {starting_agent_name} → {response.agent.name}", file=sys.stderr)
+            
+            return f"🤖 **{response.agent.name}**:\n\n{agent_response}{transfer_info}"
+            
+        except Exception as e:
+            error_msg = f"❌ Swarm error: {str(e)}"
+            print(error_msg, file=sys.stderr)
+            return error_msg
 
 async def create_finance_team_handler(args):
     """Create finance team with Swarm coordination"""
@@ -210,26 +590,21 @@ async def create_finance_team_handler(args):
         }
     }
     
-    created_agents = []
-    for name, specs in team_specs.items():
-        if name not in agents:
-            # Create ClaudeAgent object
-            agent = ClaudeAgent(
-                name=name,
-                model=specs["model"],
-                instructions=specs["instructions"],
-                functions=[]
-            )
-            agents[name] = agent
-            created_agents.append(name)
+    # Create all missing ClaudeAgent objects together; nothing here awaits, so
+    # concurrent calls can't both see an agent as missing
+    new_agents = _batch_create_agents({
+        name: specs for name, specs in team_specs.items() if name not in agents
+    })
+    agents.update(new_agents)
+    created_agents = list(new_agents)
     
     if created_agents:
         # Setup transfer functions for true Swarm behavior
-        _setup_transfer_functions()
+        _add_transfer_functions(*created_agents)
         
         global current_agent
         current_agent = "Risk_Analyst"
-        save_agents()
+        schedule_save(*created_agents)
         
         print(f"✓ Created Swarm finance team: {created_agents}", file=sys.stderr)
     
@@ -249,7 +624,7 @@ async def create_finance_team_handler(args):
 
 async def get_conversation_history_handler(args):
     """Get the current Swarm conversation state"""
-    global conversation_history, current_agent, context_variables
+    global current_agent, context_variables
     
     if not conversation_history:
         return "📝 No conversation history yet. Start chatting to see Swarm coordination!"
@@ -260,66 +635,70 @@ async def get_conversation_history_handler(args):
     result += f"**Message Count**: {len(conversation_history)}\n\n"
     
     result += "**Recent Messages**:\n"
-    for i, msg in enumerate(conversation_history[-5:], 1):
+    recent = list(islice(reversed(conversation_history), 5))[::-1]
+    for i, msg in enumerate(recent, 1):
         role = msg.get("role", "unknown").title()
-        content = msg.get("content", "")[:100]
+        content = msg.get("_preview", "")
         result += f"{i}. **{role}**: {content}...\n"
     
     return result
 
+# Tool schemas never change, so they are built once rather than per request
+TOOLS = [
+    {
+        "name": "create_agent",
+        "description": "Create a new Swarm agent with transfer capabilities",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string", "description": "Agent name"},
+                "instructions": {"type": "string", "description": "Agent instructions (include transfer conditions)"},
+                "model": {"type": "string", "default": "claude-3-5-sonnet-20241022"}
+            },
+            "required": ["name", "instructions"]
+        }
+    },
+    {
+        "name": "chat_with_swarm",
+        "description": "Chat using Claude Swarm with automatic agent coordination",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "message": {"type": "string", "description": "Your message"},
+                "agent_name": {"type": "string", "description": "Starting agent (optional)"}
+            },
+            "required": ["message"]
+        }
+    },
+    {
+        "name": "create_finance_team",
+        "description": "Create coordinated finance team with Swarm handoffs",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "company_name": {"type": "string", "default": "Investment Firm"}
+            }
+        }
+    },
+    {
+        "name": "get_conversation_history",
+        "description": "View Swarm conversation state and agent transfers",
+        "inputSchema": {"type": "object", "properties": {}}
+    },
+    {
+        "name": "list_agents",
+        "description": "List all Swarm agents and their transfer functions",
+        "inputSchema": {"type": "object", "properties": {}}
+    }
+]
+
 def create_server():
     """Create MCP server with true Swarm integration"""
     server = Server("claude-swarm")
     
     @server.list_tools()
     async def list_tools():
-        return [
-            {
-                "name": "create_agent",
-                "description": "Create a new Swarm agent with transfer capabilities",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "name": {"type": "string", "description": "Agent name"},
-                        "instructions": {"type": "string", "description": "Agent instructions (include transfer conditions)"},
-                        "model": {"type": "string", "default": "claude-3-5-sonnet-20241022"}
-                    },
-                    "required": ["name", "instructions"]
-                }
-            },
-            {
-                "name": "chat_with_swarm",
-                "description": "Chat using Claude Swarm with automatic agent coordination",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "message": {"type": "string", "description": "Your message"},
-                        "agent_name": {"type": "string", "description": "Starting agent (optional)"}
-                    },
-                    "required": ["message"]
-                }
-            },
-            {
-                "name": "create_finance_team",
-                "description": "Create coordinated finance team with Swarm handoffs",
-                "inputSchema": {
-                    "type": "object",
-                    "properties": {
-                        "company_name": {"type": "string", "default": "Investment Firm"}
-                    }
-                }
-            },
-            {
-                "name": "get_conversation_history",
-                "description": "View Swarm conversation state and agent transfers",
-                "inputSchema": {"type": "object", "properties": {}}
-            },
-            {
-                "name": "list_agents",
-                "description": "List all Swarm agents and their transfer functions",
-                "inputSchema": {"type": "object", "properties": {}}
-            }
-        ]
+        return TOOLS
     
     @server.call_tool()
     async def call_tool(name: str, arguments: dict):
@@ -338,10 +717,10 @@ def create_server():
                 else:
                     result = f"🔄 **Swarm Agents** ({len(agents)} total):\n\n"
                     for name, agent in agents.items():
-                        transfer_count = len(agent.functions)
+                        transfer_count = sum(1 for func in agent.functions if func is not search_history)
                         current_marker = "▶️" if name == current_agent else "🤖"
                         result += f"{current_marker} **{name}** ({transfer_count} transfer functions)\n"
-                        result += f"   Instructions: {agent.instructions[:80]}...\n\n"
+                        result += f"   Instructions: {agent_previews.get(name, '')}...\n\n"
             else:
                 result = f"❌ Unknown tool: {name}"
             
@@ -356,11 +735,14 @@ def create_server():
 
 async def main():
     """Main entry point"""
+    global _saves_stopping
     print("=== True Claude Swarm MCP Server ===", file=sys.stderr)
     
     # Load existing Swarm agents
     load_agents()
     
+    save_task = asyncio.create_task(_save_worker())
+    
     # Create server
     server = create_server()
     print("✓ Swarm server created", file=sys.stderr)
@@ -386,6 +768,14 @@ async def main():
             
     except Exception as e:
         print(f"✗ Server error: {e}", file=sys.stderr)
+    finally:
+        _swarm_executor.shutdown(wait=False)
+        
+        # Let the save worker finish any write in progress and flush what's left;
+        # cancelling it mid-write would race the final flush on the same file
+        _saves_stopping = True
+        _agents_dirty.set()
+        await save_task
 
 if __name__ == "__main__":
     asyncio.run(main())
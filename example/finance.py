@@ -5,9 +5,13 @@ Demonstrates multi-agent coordination for portfolio analysis
 """
 
 import asyncio
-import json
 from pathlib import Path
 
+# numba and scipy are example-only: pip install -r example/requirements.txt
+import numpy as np
+from numba import njit
+from scipy.linalg import cho_factor, cho_solve
+
 # This would be imported from the main package
 # from claude_swarm import ClaudeSwarm, ClaudeAgent
 
@@ -131,6 +135,135 @@ def example_agent_coordination():
         else:
             print("   ✅ Analysis complete")
 
+# Daily returns laid out as [asset, day], reused across calls instead of
+# allocating a fresh array per request
+N_ASSETS = 7
+N_DAYS = 252
+returns_buf = np.empty((N_ASSETS, N_DAYS), dtype=np.float32)
+
+# Compiled kernels; they need NumPy arrays, so agents call the wrappers below
+@njit(cache=True, fastmath=True)
+def _var_kernel(returns, confidence_level):
+    # Only the k-th smallest return is needed, so select rather than sort
+    var_index = int(confidence_level * returns.shape[-1])
+    return np.partition(returns, var_index)[..., var_index]
+
+@njit(cache=True, fastmath=True)
+def _sharpe_kernel(returns, risk_free_rate):
+    # Mean and (population) std from a single pass over returns
+    total = 0.0
+    total_sq = 0.0
+    for r in returns:
+        total += r
+        total_sq += r * r
+    mean = total / returns.shape[0]
+    volatility = np.sqrt(max(total_sq / returns.shape[0] - mean * mean, 0.0))
+    excess_returns = mean - risk_free_rate
+    return excess_returns / volatility if volatility > 0 else 0.0
+
+# Risk calculation functions
+def calculate_portfolio_var(returns, confidence_level=0.05):
+    """Calculate Historical Value at Risk along the last (time) axis, per asset for [asset, day] input"""
+    return _var_kernel(np.asarray(returns), confidence_level)
+
+def calculate_sharpe_ratio(returns, risk_free_rate=0.02):
+    """Calculate Sharpe Ratio"""
+    # The kernel walks a flat series; multi-asset input pools every return, as np.mean/np.std did
+    return _sharpe_kernel(np.ravel(returns), risk_free_rate)
+
+@njit(cache=True)
+def project_simplex(w):
+    """Project weights in place onto the long-only budget set (w >= 0, sum(w) = 1)"""
+    u = np.sort(w)[::-1]
+    cumulative = 0.0
+    theta = 0.0
+    for i in range(u.shape[0]):
+        cumulative += u[i]
+        t = (cumulative - 1.0) / (i + 1)
+        if u[i] - t > 0:
+            theta = t
+    for i in range(w.shape[0]):
+        w[i] = max(w[i] - theta, 0.0)
+
+@njit(cache=True, fastmath=True)
+def mv_step(cov, mu, w, grad, lr, risk_tolerance):
+    """One projected gradient ascent step on w·mu - w·cov·w / (2 * risk_tolerance)"""
+    n = w.shape[0]
+    for i in range(n):
+        acc = 0.0
+        for j in range(n):
+            acc += cov[i, j] * w[j]
+        grad[i] = mu[i] - acc / risk_tolerance
+    for i in range(n):
+        w[i] += lr * grad[i]
+    project_simplex(w)
+
+@njit(cache=True, fastmath=True)
+def solve_long_only(cov, mu, w, lr, risk_tolerance, tol, max_iter):
+    """Accelerated (FISTA) projected gradient ascent on w in place; returns the iterations used"""
+    # Stops once no weight moves more than tol; momentum restarts when it opposes the latest step
+    n = w.shape[0]
+    y = w.copy()
+    w_prev = w.copy()
+    grad = np.empty_like(w)
+    t = 1.0
+    for iteration in range(max_iter):
+        w[:] = y
+        mv_step(cov, mu, w, grad, lr, risk_tolerance)
+        
+        t_next = (1.0 + np.sqrt(1.0 + 4.0 * t * t)) / 2.0
+        momentum = (t - 1.0) / t_next
+        change = 0.0
+        alignment = 0.0
+        for i in range(n):
+            step = w[i] - w_prev[i]
+            change = max(change, abs(step))
+            alignment += (y[i] - w[i]) * step
+        if alignment > 0:
+            # Momentum overshot, so restart from a plain gradient step
+            t_next = 1.0
+            momentum = 0.0
+        for i in range(n):
+            y[i] = w[i] + momentum * (w[i] - w_prev[i])
+            w_prev[i] = w[i]
+        t = t_next
+        
+        if change < tol:
+            return iteration + 1
+    return max_iter
+
+def optimize_portfolio(expected_returns, cov_matrix, risk_tolerance=1.0, tol=1e-6, max_iter=10000):
+    """Long-only mean-variance optimization"""
+    # Maximizes w·mu - w·cov·w / (2 * risk_tolerance) with w >= 0, sum(w) = 1, all in float32
+    mu = np.asarray(expected_returns, dtype=np.float32)
+    cov = np.asarray(cov_matrix, dtype=np.float32)
+    
+    try:
+        # cov^-1 mu and cov^-1 1 from one factorization and one solve
+        factor = cho_factor(cov)
+        rhs = np.stack([mu, np.ones_like(mu)], axis=1)
+        cov_inv_mu, cov_inv_ones = cho_solve(factor, rhs).T
+        
+        # Budget constraint multiplier, then the unconstrained-sign optimum as a warm start
+        gamma = (cov_inv_mu.sum() - 1.0 / risk_tolerance) / cov_inv_ones.sum()
+        weights = (risk_tolerance * (cov_inv_mu - gamma * cov_inv_ones)).astype(np.float32)
+        project_simplex(weights)
+    except np.linalg.LinAlgError:
+        # Only positive semi-definite (cash, collinear assets, fewer days than
+        # assets): no Cholesky warm start, but the solver below still applies
+        weights = np.full(mu.shape, 1.0 / mu.shape[0], dtype=np.float32)
+    
+    # 1 / L, where L = largest eigenvalue / risk_tolerance bounds the gradient's curvature;
+    # floored so an all-zero covariance gives a large finite step, not a division by zero
+    lr = np.float32(risk_tolerance / max(np.linalg.eigvalsh(cov)[-1], 1e-8))
+    solve_long_only(cov, mu, weights, lr, np.float32(risk_tolerance), tol, max_iter)
+    
+    return {
+        "optimal_weights": weights.tolist(),
+        "expected_return": float(weights @ mu),
+        "portfolio_risk": float(np.sqrt(weights @ cov @ weights))
+    }
+
 def example_custom_functions():
     """
     Example custom functions that could be added to agents
@@ -139,29 +272,18 @@ def example_custom_functions():
     print("\n🛠️  Custom Function Examples")
     print("=" * 35)
     
-    # Risk calculation functions
-    def calculate_portfolio_var(returns, confidence_level=0.05):
-        """Calculate Historical Value at Risk"""
-        import numpy as np
-        sorted_returns = np.sort(returns)
-        var_index = int(confidence_level * len(sorted_returns))
-        return sorted_returns[var_index]
-    
-    def calculate_sharpe_ratio(returns, risk_free_rate=0.02):
-        """Calculate Sharpe Ratio"""
-        import numpy as np
-        excess_returns = np.mean(returns) - risk_free_rate
-        volatility = np.std(returns)
-        return excess_returns / volatility if volatility > 0 else 0
-    
-    def optimize_portfolio(expected_returns, cov_matrix, risk_tolerance=1.0):
-        """Mean-variance optimization"""
-        # Simplified example - in reality would use scipy.optimize
-        return {
-            "optimal_weights": [0.2, 0.2, 0.2, 0.2, 0.2],
-            "expected_return": 0.10,
-            "portfolio_risk": 0.15
-        }
+    # Simulated daily returns, written straight into the shared buffer
+    rng = np.random.default_rng(42)
+    rng.standard_normal(dtype=np.float32, out=returns_buf)
+    np.multiply(returns_buf, 0.02, out=returns_buf)
+    asset_var = calculate_portfolio_var(returns_buf)
+    print(f"Per-asset 95% VaR (simulated): {', '.join(f'{v:.2%}' for v in asset_var)}")
+    
+    # Annualized inputs for the optimizer, kept in float32
+    expected_returns = returns_buf.mean(axis=1, dtype=np.float32) * N_DAYS
+    cov_matrix = np.cov(returns_buf, dtype=np.float32) * N_DAYS
+    optimal = optimize_portfolio(expected_returns, cov_matrix, risk_tolerance=0.02)
+    print(f"Optimal weights (simulated): {', '.join(f'{w:.1%}' for w in optimal['optimal_weights'])}\n")
     
     print("Functions that could be added to agents:")
     print("- calculate_portfolio_var(): Historical VaR calculation")